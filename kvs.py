@@ -5,6 +5,10 @@ try:
 except ImportError:
   import dbm
 
+from contextlib import contextmanager
+import struct
+import zlib
+
 
 # import directive
 __all__ = (
@@ -14,26 +18,145 @@ __all__ = (
 __author__ = 'Hansheng Zhao'
 __license__ = 'BSD-2-Clause + MIT'
 __version__ = '1.0.0'
+# fixed-width packers for binary numeric keys
+_INT_PACK = struct.Struct('<q').pack
+_FLOAT_PACK = struct.Struct('<d').pack
+
+
+def _convert(key):
+  """
+  Convert key to supported format
+  :param key: mixed, any hashable object
+  :return: bytes, bytes representation of key
+  """
+  # fast path for the most common key types,
+  #   identity check skips walking the MRO
+  if type(key) is str:
+    return key.encode('UTF8')
+  elif type(key) is bytes:
+    return key
+  # check if key is supported or hashable
+  # supports only bytes by default
+  elif isinstance(key, bytes):
+    return key
+  # encode string type
+  elif isinstance(key, str):
+    return key.encode('UTF8')
+  # change byte-array into bytes
+  elif isinstance(key, bytearray):
+    return bytes(key)
+  # convert numeric into string
+  elif isinstance(key, (int, float, complex)):
+    return str(key).encode('UTF8')
+  # convert hashable collections into string
+  elif isinstance(key, (range, tuple, frozenset)):
+    return str(key).encode('UTF8')
+  # other types not supported
+  else:
+    raise TypeError('Unsupported type.')
+
+
+def _convert_binary(key):
+  """
+  Convert key, packing numeric keys into bytes
+  :param key: mixed, any hashable object
+  :return: bytes, bytes representation of key
+  """
+  # pack numeric keys into fixed-width bytes
+  if type(key) is int \
+    and -(1 << 63) <= key < (1 << 63):
+    return _INT_PACK(key)
+  elif type(key) is float:
+    return _FLOAT_PACK(key)
+  return _convert(key)
+
+
+class _ThresholdSerializer(object):
+  """ JSON serializer compressing only large payloads """
+
+  # statically defined attributes
+  __slots__ = ('_threshold', '_serializer')
+
+  def __init__(self, threshold):
+    """
+    Threshold serializer constructor
+    :param threshold: int, minimum bytes to compress
+    """
+    # import the json serializer SeCo uses
+    import simplejson
+    self._threshold = threshold
+    self._serializer = simplejson
+
+  def dumps(self, payload):
+    """
+    Serialize and tag payload, compress if large
+    :param payload: mixed, serializable object
+    :return: bytes, the tagged payload
+    """
+    payload = self._serializer.dumps(payload).encode('UTF8')
+    # small payloads are stored uncompressed
+    if len(payload) < self._threshold:
+      return b'\x00' + payload
+    return b'\x01' + zlib.compress(payload)
+
+  def loads(self, payload):
+    """
+    Deserialize tagged payload
+    :param payload: bytes, the tagged payload
+    :return: mixed, the object
+    """
+    loads = self._serializer.loads
+    if payload[0] == 0:
+      return loads(payload[1:], encoding = 'UTF8')
+    return loads(
+      zlib.decompress(payload[1:]), encoding = 'UTF8'
+    )
 
 
 class KVS(object):
   """ KVS class for K-V pair storage """
 
   # statically defined attributes
-  __slots__ = ('_database', '_serialize')
+  __slots__ = (
+    '_database', '_serialize', '_batch',
+    '_get', '_set', '_del', '_contains', '_clear',
+    '_dumps', '_loads', '_attr_cache',
+    '_closed', '_open_args', '_lint'
+  )
+  # slot names for attribute proxy dispatch
+  _SLOT_NAMES = frozenset(__slots__)
 
   def __init__(
     self, database = ':memory:',
-    serialize = None, **kwargs
+    serialize = None, compress_min_bytes = None,
+    binary_keys = False, **kwargs
   ):
     """
     KVStore class constructor
     :param database: object, database path or instance
     :param serialize: object|None, the serializer
+    :param compress_min_bytes: int|None, compress threshold
+    :param binary_keys: bool, pack int and float keys
     :param kwargs: other arguments
     """
     # import
     from seco import SeCo
+    # cache for database attribute lookups
+    self._attr_cache = {}
+    # key converter, chosen once per instance
+    self._lint = _convert_binary \
+      if binary_keys else _convert
+    # no write batch in progress
+    self._batch = None
+    # database connection not yet closed
+    self._closed = False
+    # dbm open arguments, None if not opened by path
+    self._open_args = None
+    # threshold applies to the built-in serializer only
+    if serialize is not None and compress_min_bytes is not None:
+      raise ValueError(
+        'compress_min_bytes cannot be used with serialize.'
+      )
     # check if using on-disk|in-memory|external store
     if isinstance(database, (str, bytes, bytearray)):
       # convert bytes and byte-array into string
@@ -44,22 +167,57 @@ class KVS(object):
       if database.lower() == ':memory:':
         self._database = {}
       else:
-        flag = kwargs['flag'] \
-          if 'flag' in kwargs else 'c'
+        flag = kwargs.pop('flag', 'c')
+        mode = kwargs.pop('mode', 0o666)
         self._database = \
-          dbm.open(database, flag, **kwargs)
+          dbm.open(database, flag, mode, **kwargs)
+        self._open_args = (database, flag, mode)
     # any object is now considered database
-    elif isinstance(database, dict) or True:
+    else:
       # using external storage
       self._database = database
     # initialize serializer
     if serialize is not None:
       self._serialize = serialize
+    elif compress_min_bytes is not None:
+      # skip compression for small values
+      self._serialize = \
+        _ThresholdSerializer(compress_min_bytes)
     else:
       self._serialize = SeCo(
         serialize = 'json', compress = 'zlib'
       )
 
+  def _resolve(self):
+    """
+    Resolve database accessors
+    :return: None
+    """
+    database = self._database
+    self._get = database.get \
+      if hasattr(database, 'get') \
+      else database.__getitem__
+    if hasattr(database, 'set'):
+      self._set = database.set
+    elif hasattr(database, 'put'):
+      self._set = database.put
+    else:
+      self._set = database.__setitem__
+    self._del = database.delete \
+      if hasattr(database, 'delete') \
+      else database.__delitem__
+    self._contains = database.__contains__ \
+      if hasattr(database, '__contains__') \
+      else None
+    if hasattr(database, 'clear'):
+      self._clear = database.clear
+    elif hasattr(database, 'flushall'):
+      self._clear = database.flushall
+    elif hasattr(database, 'flush_all'):
+      self._clear = database.flush_all
+    else:
+      self._clear = None
+
   def __call__(self, key, value = None, *args, **kwargs):
     """
     Call method for setting & getting item
@@ -71,45 +229,35 @@ class KVS(object):
     """
     if value is None:
       # read from kvstore if value not provided
-      return self.__getitem__(key, *args, **kwargs)
+      return self.get(key, *args, **kwargs)
     else:
       # set item into kvstore instead
-      self.__setitem__(key, value, *args, **kwargs)
+      self.set(key, value, *args, **kwargs)
 
-  def __del__(self):
+  def __enter__(self):
     """
-    Sync and close database connection if not in-memory
+    Context manager entry
+    :return: KVS, the instance itself
+    """
+    return self
+
+  def __exit__(self, *exc_info):
+    """
+    Sync and close database connection on exit
+    :param exc_info: tuple, the exception info
     :return: None
     """
-    self.sync()
     self.close()
 
-  @staticmethod
-  def _convert(key):
-    """
-    Convert key to supported format
-    :param key: mixed, any hashable object
-    :return: bytes, bytes representation of key
-    """
-    # check if key is supported or hashable
-    # supports only bytes by default
-    if isinstance(key, bytes):
-      return key
-    # encode string type
-    elif isinstance(key, str):
-      return key.encode(encoding = 'UTF8')
-    # change byte-array into bytes
-    elif isinstance(key, bytearray):
-      return bytes(key)
-    # convert numeric into string
-    elif isinstance(key, (int, float, complex)):
-      return str(key).encode(encoding = 'UTF8')
-    # convert hashable collections into string
-    elif isinstance(key, (range, tuple, frozenset)):
-      return str(key).encode(encoding = 'UTF8')
-    # other types not supported
-    else:
-      raise TypeError('Unsupported type.')
+  def __del__(self):
+    """
+    Best-effort close if not closed explicitly
+    :return: None
+    """
+    try:
+      self.close()
+    except Exception:
+      pass
 
   def __contains__(self, key):
     """
@@ -117,86 +265,142 @@ class KVS(object):
     :param key: mixed, any hashable key
     :return: bool, whether item exists
     """
-    database = self._database
-    key = self._convert(key)
-    return key in database \
-      if hasattr(database, '__contains__') \
-      else self.__getitem__(key) is not None
+    key = self._lint(key)
+    contains = self._contains
+    if contains is not None:
+      return contains(key)
+    return self.__getitem__(key) is not None
 
-  def __setitem__(self, key, value, *args, **kwargs):
+  def __setitem__(self, key, value):
     """
     Dict-like object setitem method
     :param key: mixed, any hashable key
     :param value: mixed, any object
+    :return: None
+    """
+    # lint key
+    key = self._lint(key)
+    # check if value is not None
+    if value is not None:
+      # serialize and compress the value
+      value = self._dumps(value)
+      # buffer the item if batching writes
+      if self._batch is not None:
+        self._batch.append((key, value, (), {}))
+      else:
+        self._set(key, value)
+    else:
+      # delete item from database instead
+      self.__delitem__(key)
+
+  def set(self, key, value, *args, **kwargs):
+    """
+    Set item, forwarding extra arguments to database
+    :param key: mixed, any hashable key
+    :param value: mixed, any object
     :param args: mixed, the arguments
     :param kwargs: dict, the kw arguments
     :return: None
     """
-    # acquire database and lint key
-    database = self._database
-    key = self._convert(key)
+    # take the fast path without extra arguments
+    if not (args or kwargs):
+      return self.__setitem__(key, value)
+    # lint key
+    key = self._lint(key)
     # check if value is not None
     if value is not None:
       # serialize and compress the value
-      value = self._serialize.dumps(value)
-      # set item into database
-      if hasattr(database, 'set'):
-        database.set(key, value, *args, **kwargs)
-      elif hasattr(database, 'put'):
-        database.put(key, value, *args, **kwargs)
+      value = self._dumps(value)
+      # buffer the item if batching writes
+      if self._batch is not None:
+        self._batch.append((key, value, args, kwargs))
       else:
-        database.__setitem__(key, value)
+        self._set(key, value, *args, **kwargs)
     else:
       # delete item from database instead
-      self.__delitem__(key, *args, **kwargs)
+      self.delete(key, *args, **kwargs)
 
-  # aliases for setitem method
-  set = put = __setitem__
+  # aliases for set method
+  put = set
 
-  def __getitem__(self, key, *args, **kwargs):
+  def __getitem__(self, key):
     """
     Dict-like object getitem method
     :param key: mixed, any hashable key
+    :return: mixed
+    """
+    # lint key and acquire item from database
+    value = self._get(self._lint(key))
+    if value:
+      return self._loads(value)
+    return None
+
+  def get(self, key, *args, **kwargs):
+    """
+    Get item, forwarding extra arguments to database
+    :param key: mixed, any hashable key
     :param args: mixed, the arguments
     :param kwargs: dict, the kw arguments
     :return: mixed
     """
-    # acquire database and lint key
-    database = self._database
-    key = self._convert(key)
-    # acquire item from database
-    value = database.get(key, *args, **kwargs) \
-      if hasattr(database, 'get') \
-      else database.__getitem__(key)
-    return self._serialize.loads(value) \
-      if value else None
-
-  # aliases for getitem method
-  get = __getitem__
+    # take the fast path without extra arguments
+    if not (args or kwargs):
+      return self.__getitem__(key)
+    # lint key and acquire item from database
+    value = self._get(self._lint(key), *args, **kwargs)
+    if value:
+      return self._loads(value)
+    return None
 
-  def __delitem__(self, key, *args, **kwargs):
+  def __delitem__(self, key):
     """
     Dict-like object delitem method
     :param key: mixed, any hashable key
+    :return: None
+    """
+    # lint key
+    key = self._lint(key)
+    # buffer the deletion if batching writes
+    if self._batch is not None:
+      self._batch.append((key, None, (), {}))
+      return None
+    return self._remove(key)
+
+  def delete(self, key, *args, **kwargs):
+    """
+    Delete item, forwarding extra arguments to database
+    :param key: mixed, any hashable key
     :param args: mixed, the arguments
     :param kwargs: dict, the kw arguments
     :return: None
     """
-    # acquire database and lint key
-    database = self._database
-    key = self._convert(key)
+    # take the fast path without extra arguments
+    if not (args or kwargs):
+      return self.__delitem__(key)
+    # lint key
+    key = self._lint(key)
+    # buffer the deletion if batching writes
+    if self._batch is not None:
+      self._batch.append((key, None, args, kwargs))
+      return None
+    return self._remove(key, *args, **kwargs)
+
+  def _remove(self, key, *args, **kwargs):
+    """
+    Remove item from database
+    :param key: bytes, the converted key
+    :param args: mixed, the arguments
+    :param kwargs: dict, the kw arguments
+    :return: None|mixed
+    """
     # attempt to remove item from database
     try:
-      return database.delete(
-        key, *args, **kwargs
-      ) if hasattr(database, 'delete') \
-        else database.__delitem__(key)
+      if args or kwargs:
+        return self._del(key, *args, **kwargs)
+      return self._del(key)
     except KeyError:
       return None
 
-  # aliases for delitem method
-  delete = __delitem__
-
   def __setattr__(self, key, value):
     """
     Proxy for saving item to database
@@ -204,10 +408,17 @@ class KVS(object):
     :param value: mixed, the value
     :return: None
     """
-    try:
-      # attempts to modify the object first
+    if key in self._SLOT_NAMES:
+      # modify the object attribute
       super(KVS, self).__setattr__(key, value)
-    except AttributeError:
+      # keep bound accessors in step with their source
+      if key == '_database':
+        self._attr_cache.clear()
+        self._resolve()
+      elif key == '_serialize':
+        self._dumps = value.dumps
+        self._loads = value.loads
+    else:
       # set item into database instead
       self.__setitem__(key, value)
 
@@ -217,12 +428,20 @@ class KVS(object):
     :param key: str, the attribute name
     :return: mixed, function or value
     """
+    # return previously resolved database method
+    cache = self._attr_cache
+    if key in cache:
+      return cache[key]
     try:
       # attempt to acquire attributes first
-      return self._database.__getattribute__(key)
+      value = self._database.__getattribute__(key)
     except AttributeError:
       # return database item instead
       return self.__getitem__(key)
+    # cache methods only, plain attributes may change
+    if callable(value):
+      cache[key] = value
+    return value
 
   def __delattr__(self, key):
     """
@@ -230,10 +449,10 @@ class KVS(object):
     :param key: str, the kv-pair key
     :return: None
     """
-    try:
-      # attempt to delete attribute first
+    if key in self._SLOT_NAMES:
+      # delete the object attribute
       super(KVS, self).__delattr__(key)
-    except AttributeError:
+    else:
       # delete from database
       self.__delitem__(key)
 
@@ -247,51 +466,123 @@ class KVS(object):
     self.__delitem__(key)
     return value
 
+  @contextmanager
+  def batch(self):
+    """
+    Buffer writes and flush them in one pass
+    :return: generator, the context manager
+    """
+    # join the outer batch if already batching
+    if self._batch is not None:
+      yield self
+      return
+    self._batch = []
+    try:
+      yield self
+    except BaseException:
+      # discard buffered writes on failure
+      self._batch = None
+      raise
+    # flush buffered writes and sync once
+    buffer, self._batch = self._batch, None
+    for key, value, args, kwargs in buffer:
+      if value is None:
+        self._remove(key, *args, **kwargs)
+      elif args or kwargs:
+        self._set(key, value, *args, **kwargs)
+      else:
+        self._set(key, value)
+    self.sync()
+
+  def bulk_set(self, mapping):
+    """
+    Set multiple items in a single batch
+    :param mapping: dict|iterable, k-v pairs
+    :return: None
+    """
+    # accept both mappings and k-v pair iterables
+    if hasattr(mapping, 'items'):
+      mapping = mapping.items()
+    # bind callables once for the whole batch
+    lint, dumps = self._lint, self._dumps
+    with self.batch():
+      append = self._batch.append
+      for key, value in mapping:
+        # None values are buffered as deletions
+        if value is not None:
+          value = dumps(value)
+        append((lint(key), value, (), {}))
+
+  # aliases for bulk_set method
+  multi_set = write_batch = bulk_set
+
+  def multi_get(self, keys):
+    """
+    Get multiple items in a single pass
+    :param keys: iterable, hashable keys
+    :return: list, values or None if missing
+    """
+    # bind callables once for the whole pass
+    get, lint, loads = self._get, self._lint, self._loads
+    values = []
+    append = values.append
+    for key in keys:
+      value = get(lint(key))
+      if value:
+        append(loads(value))
+      else:
+        append(None)
+    return values
+
   def keys(self):
     """
     Acquire all the keys in database
     :return: collection|generator, keys
     """
-    yield from self._database.keys() \
-      if hasattr(self._database, 'keys') \
-      else ()
+    if hasattr(self._database, 'keys'):
+      yield from self._database.keys()
 
   def values(self):
     """
     Acquire all the values in database
     :return: collection|generator, values
     """
+    database = self._database
     # check if method already exists
-    if hasattr(self._database, 'values'):
-      yield from map(
-        lambda _: self._serialize.loads(_),
-        self._database.values()
-      )
+    if hasattr(database, 'values'):
+      # map with the bound loads, no per-item lambda
+      yield from map(self._loads, database.values())
     else:
       # create generator for values
+      getitem = self.__getitem__
       for key in self.keys():
-        yield self.__getitem__(key)
+        yield getitem(key)
 
   def items(self):
     """
     Acquire k-v pairs in database
     :return: collection| generator, tuples
     """
+    database = self._database
     # check if method already exists
-    if hasattr(self._database, 'items'):
-      yield from map(lambda _: (
-        _[0], self._serialize.loads(_[1])
-      ), self._database.items())
+    if hasattr(database, 'items'):
+      loads = self._loads
+      for key, value in database.items():
+        yield (key, loads(value))
     else:
       # create generator for items
+      getitem = self.__getitem__
       for key in self.keys():
-        yield (key, self.__getitem__(key))
+        yield (key, getitem(key))
 
   def sync(self):
     """
     Commit changes to disk
     :return: None
     """
+    # nothing to commit once closed
+    if self._closed:
+      return
     # check if is in-memory mode
     if hasattr(self._database, 'sync'):
       self._database.sync()
@@ -309,22 +600,42 @@ class KVS(object):
     Close database connection
     :return: None
     """
+    # avoid syncing and closing twice
+    if self._closed:
+      return
     self.sync()
     if hasattr(self._database, 'close'):
       self._database.close()
+    self._closed = True
 
   def clear(self):
     """
     Clear database content
     :return: None
     """
-    if hasattr(self._database, 'clear'):
-      self._database.clear()
-    elif hasattr(self._database, 'flushall'):
-      self._database.flushall()
-    elif hasattr(self._database, 'flush_all'):
-      self._database.flush_all()
+    # drop writes buffered before clearing
+    if self._batch is not None:
+      del self._batch[:]
+    if self._clear is not None:
+      self._clear()
+    elif self._open_args is not None \
+      and not self._closed \
+      and self._open_args[1][:1] != 'r':
+      # recreate the on-disk database at once
+      #   instead of deleting items one by one
+      path, flag, mode = self._open_args
+      # reopen with the backend actually in use,
+      #   dbm.open skips detection for the 'n' flag
+      which = dbm.whichdb(path)
+      opener = __import__(which, fromlist = ['open']).open \
+        if which else dbm.open
+      flag = 'n' + flag[1:]
+      # backend openers take mode positionally
+      self._database.close()
+      self._database = opener(path, flag, mode)
     else:
-      for key in self.keys():
-        self.__delitem__(key)
+      # snapshot keys before deleting
+      remove = self._remove
+      for key in list(self.keys()):
+        remove(key)
       self.optimize()
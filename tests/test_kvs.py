@@ -0,0 +1,334 @@
+# Author: Hansheng Zhao <copyrighthero@gmail.com> (https://www.zhs.me)
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from kvs import KVS
+
+
+class Store(object):
+  """ Minimal external store without dict protocol """
+
+  def __init__(self):
+    self.data = {}
+
+  def get(self, key):
+    return self.data.get(key)
+
+  def set(self, key, value):
+    self.data[key] = value
+
+  def delete(self, key):
+    del self.data[key]
+
+  def keys(self):
+    return self.data.keys()
+
+
+class ForwardStore(Store):
+  """ Store recording forwarded arguments """
+
+  def __init__(self):
+    super(ForwardStore, self).__init__()
+    self.forwarded = []
+
+  def get(self, key, *args, **kwargs):
+    self.forwarded.append(('get', args, kwargs))
+    return self.data.get(key)
+
+  def set(self, key, value, *args, **kwargs):
+    self.forwarded.append(('set', args, kwargs))
+    self.data[key] = value
+
+  def delete(self, key, *args, **kwargs):
+    self.forwarded.append(('delete', args, kwargs))
+    del self.data[key]
+
+
+class KVSBatchTest(unittest.TestCase):
+  """ Tests for batched writes """
+
+  def test_batch_flushes_on_exit(self):
+    kvs = KVS()
+    with kvs.batch():
+      kvs['a'] = 1
+      kvs['b'] = [2]
+      del kvs['a']
+      # buffered writes are not visible yet
+      self.assertIsNone(kvs['b'])
+    self.assertIsNone(kvs['a'])
+    self.assertEqual(kvs['b'], [2])
+
+  def test_nested_batch_joins_outer(self):
+    kvs = KVS()
+    with kvs.batch():
+      with kvs.batch():
+        kvs['a'] = 1
+      self.assertIsNone(kvs['a'])
+    self.assertEqual(kvs['a'], 1)
+
+  def test_batch_discards_on_error(self):
+    kvs = KVS()
+    with self.assertRaises(ValueError):
+      with kvs.batch():
+        kvs['a'] = 1
+        raise ValueError
+    self.assertIsNone(kvs['a'])
+
+  def test_clear_inside_batch(self):
+    kvs = KVS()
+    kvs['old'] = 0
+    with kvs.batch():
+      kvs['a'] = 1
+      kvs.clear()
+      kvs['b'] = 2
+    self.assertIsNone(kvs['old'])
+    self.assertIsNone(kvs['a'])
+    self.assertEqual(kvs['b'], 2)
+
+  def test_bulk_set(self):
+    kvs = KVS()
+    kvs.bulk_set({'a': 1, 'b': 2})
+    kvs.write_batch([('c', 3), ('a', None)])
+    self.assertIsNone(kvs['a'])
+    self.assertEqual(kvs['b'], 2)
+    self.assertEqual(kvs['c'], 3)
+
+  def test_multi_set_and_multi_get(self):
+    kvs = KVS()
+    kvs.multi_set([('a', 1), ('b', [2]), ('c', None)])
+    kvs.multi_set({'a': None})
+    self.assertEqual(
+      kvs.multi_get(['a', 'b', 'c']), [None, [2], None]
+    )
+
+
+class KVSBackendTest(unittest.TestCase):
+  """ Tests for external databases """
+
+  def test_external_backend(self):
+    store = Store()
+    kvs = KVS(store)
+    kvs['a'] = 1
+    self.assertIn(b'a', store.data)
+    self.assertEqual(kvs['a'], 1)
+    # membership falls back to get
+    self.assertIn('a', kvs)
+    self.assertNotIn('b', kvs)
+    del kvs['a']
+    del kvs['b']
+    self.assertEqual(store.data, {})
+
+  def test_clear_after_close_in_memory(self):
+    kvs = KVS()
+    kvs.close()
+    kvs['a'] = 1
+    kvs.clear()
+    self.assertIsNone(kvs['a'])
+
+  def test_clear_without_clear_method(self):
+    store = Store()
+    kvs = KVS(store)
+    kvs['a'] = 1
+    kvs['b'] = 2
+    kvs.clear()
+    self.assertEqual(store.data, {})
+
+  def test_forward_arguments(self):
+    store = ForwardStore()
+    kvs = KVS(store)
+    kvs.set('a', 1, 10, ex = 5)
+    kvs.get('a', 'default')
+    kvs.delete('a', block = True)
+    kvs('b', 2, ex = 1)
+    kvs['c'] = 3
+    self.assertEqual(store.forwarded, [
+      ('set', (10, ), {'ex': 5}),
+      ('get', ('default', ), {}),
+      ('delete', (), {'block': True}),
+      ('set', (), {'ex': 1}),
+      ('set', (), {}),
+    ])
+
+  def test_forward_arguments_in_batch(self):
+    store = ForwardStore()
+    kvs = KVS(store)
+    with kvs.batch():
+      kvs.set('a', 1, ex = 5)
+      kvs.delete('b', 3)
+      # arguments are buffered with the item
+      self.assertEqual(kvs._batch[0][2:], ((), {'ex': 5}))
+      self.assertEqual(kvs._batch[1][1:], (None, (3, ), {}))
+      self.assertEqual(store.forwarded, [])
+    self.assertEqual(store.forwarded, [
+      ('set', (), {'ex': 5}),
+      ('delete', (3, ), {}),
+    ])
+
+
+class KVSAttributeTest(unittest.TestCase):
+  """ Tests for attribute proxies """
+
+  def test_database_methods_cached(self):
+    kvs = KVS()
+    self.assertIs(kvs.copy, kvs.copy)
+    self.assertIn('copy', kvs._attr_cache)
+    # missing attributes fall back to items
+    self.assertIsNone(kvs.missing)
+    self.assertNotIn('missing', kvs._attr_cache)
+
+  def test_attribute_dispatch(self):
+    kvs = KVS()
+    kvs.name = 'value'
+    self.assertIn(b'name', kvs._database)
+    self.assertEqual(kvs.name, 'value')
+    # slot names modify the instance instead
+    kvs._batch = []
+    self.assertNotIn(b'_batch', kvs._database)
+    self.assertEqual(kvs._batch, [])
+    kvs._batch = None
+    del kvs.name
+    self.assertNotIn(b'name', kvs._database)
+
+  def test_reassigning_sources_rebinds(self):
+    import pickle
+    kvs = KVS()
+    kvs._serialize = pickle
+    self.assertIs(kvs._dumps, pickle.dumps)
+    kvs['a'] = (1, )
+    self.assertEqual(kvs['a'], (1, ))
+    before = kvs.copy
+    store = {}
+    kvs._database = store
+    kvs['b'] = 2
+    self.assertEqual(list(store), [b'b'])
+    self.assertIs(kvs.copy.__self__, store)
+    self.assertIsNot(kvs.copy, before)
+
+
+class KVSOptionTest(unittest.TestCase):
+  """ Tests for constructor options """
+
+  def test_compress_min_bytes(self):
+    kvs = KVS(compress_min_bytes = 128)
+    kvs['small'] = 'x'
+    kvs['large'] = 'y' * 512
+    self.assertEqual(kvs._database[b'small'][:1], b'\x00')
+    self.assertEqual(kvs._database[b'large'][:1], b'\x01')
+    self.assertEqual(kvs['small'], 'x')
+    self.assertEqual(kvs['large'], 'y' * 512)
+
+  def test_compress_min_bytes_stores_same_types(self):
+    kvs = KVS(compress_min_bytes = 4)
+    kvs['small'] = b'raw'
+    kvs['large'] = b'raw' * 64
+    # bytes round-trip as str, same as the default serializer
+    self.assertEqual(kvs['small'], KVS()._loads(KVS()._dumps(b'raw')))
+    self.assertEqual(kvs['small'], 'raw')
+    self.assertEqual(kvs['large'], 'raw' * 64)
+
+  def test_compress_min_bytes_with_serialize(self):
+    import pickle
+    with self.assertRaises(ValueError):
+      KVS(serialize = pickle, compress_min_bytes = 128)
+
+  def test_key_converter_chosen_once(self):
+    import kvs as module
+    self.assertIs(KVS()._lint, module._convert)
+    self.assertIs(
+      KVS(binary_keys = True)._lint, module._convert_binary
+    )
+
+  def test_binary_keys(self):
+    kvs = KVS(binary_keys = True)
+    kvs[1] = 'int'
+    kvs[2.5] = 'float'
+    self.assertIn(b'\x01' + b'\x00' * 7, kvs._database)
+    self.assertEqual(kvs[1], 'int')
+    self.assertEqual(kvs[2.5], 'float')
+
+
+class KVSFileTest(unittest.TestCase):
+  """ Tests for on-disk databases """
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'db')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_context_manager_closes(self):
+    with KVS(self.path) as kvs:
+      kvs['a'] = 1
+    with KVS(self.path) as kvs:
+      self.assertEqual(kvs['a'], 1)
+
+  def test_close_is_idempotent(self):
+    kvs = KVS(self.path)
+    kvs['a'] = 1
+    kvs.close()
+    self.assertTrue(kvs._closed)
+    # neither touches the closed handle
+    kvs.sync()
+    kvs.close()
+
+  def test_clear_reopens_database(self):
+    with KVS(self.path) as kvs:
+      kvs['a'] = 1
+      # force the reopen path
+      kvs._clear = None
+      kvs.clear()
+      self.assertEqual(list(kvs.keys()), [])
+      kvs['b'] = 2
+    with KVS(self.path) as kvs:
+      self.assertIsNone(kvs['a'])
+      self.assertEqual(kvs['b'], 2)
+
+  def test_clear_reopen_refreshes_attributes(self):
+    with KVS(self.path) as kvs:
+      before = kvs.setdefault
+      kvs._clear = None
+      kvs.clear()
+      self.assertIsNot(kvs.setdefault, before)
+      self.assertIs(kvs.setdefault.__self__, kvs._database)
+
+  def test_clear_after_close(self):
+    import dbm
+    kvs = KVS(self.path)
+    kvs['a'] = 1
+    kvs._clear = None
+    kvs.close()
+    # the closed handle is not reopened
+    with self.assertRaises(dbm.error):
+      kvs.clear()
+    self.assertTrue(kvs._closed)
+    with KVS(self.path) as kvs:
+      self.assertEqual(kvs['a'], 1)
+
+  def test_clear_reopen_passes_mode_positionally(self):
+    import dbm
+    import importlib
+    from unittest import mock
+    with KVS(self.path, mode = 0o600) as kvs:
+      kvs['a'] = 1
+      kvs._clear = None
+      module = importlib.import_module(dbm.whichdb(self.path))
+      opener = module.open
+      calls = []
+
+      # gdbm and ndbm openers reject keyword arguments
+      def strict_open(*args):
+        calls.append(args)
+        return opener(*args)
+
+      with mock.patch.object(module, 'open', strict_open):
+        kvs.clear()
+      self.assertEqual(calls, [(self.path, 'n', 0o600)])
+      self.assertEqual(list(kvs.keys()), [])
+
+
+if __name__ == '__main__':
+  unittest.main()